@@ -2,12 +2,13 @@ import os
 import requests
 import logging
 import datetime
+import functools
 import json
 import random
 import re
-import gspread
-from dateutil import parser
-from google.oauth2.service_account import Credentials
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ====== LOGGING ======
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -24,13 +25,94 @@ SHEET_ID = "1NvNUmFQ_p5rf5uoTnwywtsYFDuKcTZFx0kE66msLsmE"  # <- your sheet id
 
 # ====== CONFIG ======
 DAILY_POST_LIMIT = 3
+GROQ_CHAT_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_BASE_PAYLOAD = {  # constant part of every chat request; messages are added per call
+    "model": "llama-3.3-70b-versatile",
+    "max_tokens": 300,
+    "temperature": 0.7,
+    "top_p": 0.9,
+}
+HF_API_URL = "https://api-inference.huggingface.co/"
 HF_IMAGE_MODEL = "stabilityai/stable-diffusion-xl-base-1.0"
 IMAGE_WIDTH = 512
 IMAGE_HEIGHT = 512
 WORKSHEET_NAME = "FB_Bot_Memory"
+# (connect, read) seconds: fail fast on unreachable hosts, allow slow generation
+TEXT_TIMEOUT = (5, 60)
+IMAGE_TIMEOUT = (5, 120)
+FB_TIMEOUT = (5, 60)
+RETRY_AFTER_MAX = 30  # seconds; longest server Retry-After the bot will sleep for
+
+# ====== HTTP SESSION (shared keep-alive pool for Groq / HF / Facebook) ======
+class CappedRetry(Retry):
+    """Retry that honors Retry-After but never sleeps longer than RETRY_AFTER_MAX."""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, RETRY_AFTER_MAX)
+
+class RateLimitOnlyRetry(CappedRetry):
+    """Retry only 429s; urllib3 would otherwise also retry 413/503 responses carrying Retry-After."""
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        return status_code == 429 and super().is_retry(method, status_code, has_retry_after)
+
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=CappedRetry(
+            total=3,
+            read=0,  # a timed-out completion may still be billed; don't send it again
+            backoff_factor=2,
+            backoff_jitter=1.0,  # add up to 1s random delay to each backoff wait after the first retry
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset(["GET", "POST"]),
+            raise_on_status=False,  # hand the last response to raise_for_status so its body is logged
+        ),
+    ),
+)
+# Graph publishes are not idempotent: only retry a 429 (request not processed), never a 5xx or read timeout
+SESSION.mount(
+    "https://graph.facebook.com/",
+    HTTPAdapter(
+        max_retries=RateLimitOnlyRetry(
+            total=3,
+            read=0,
+            backoff_factor=2,
+            status_forcelist=[429],
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False,
+        ),
+    ),
+)
+# HF answers 503 while a cold model loads, so give it more, capped retries
+SESSION.mount(
+    HF_API_URL,
+    HTTPAdapter(
+        max_retries=CappedRetry(
+            total=4,
+            read=0,  # a hung inference read already used IMAGE_TIMEOUT; don't repeat it
+            backoff_factor=2,
+            backoff_max=30,
+            backoff_jitter=1.0,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False,
+        ),
+    ),
+)
 
 # ====== GOOGLE SHEETS SETUP ======
+@functools.lru_cache(maxsize=1)
 def get_sheet():
+    """Authorize and open the worksheet once per process; later calls reuse the handle."""
+    # Imported here so runs that exit early (missing env vars) skip the Google client imports
+    import gspread
+    from google.oauth2.service_account import Credentials
+
     creds_dict = json.loads(GOOGLE_CREDS_JSON)
     creds = Credentials.from_service_account_info(
         creds_dict,
@@ -43,109 +125,120 @@ def get_sheet():
     return client.open_by_key(SHEET_ID).worksheet(WORKSHEET_NAME)
 
 # ====== SHEET LOGGING ======
-def mark_posted(message, post_number, topic, fb_post_id=None):
-    """Append a log row: [YYYY-MM-DD, Topic, Message, PostNumber, FBPostID]"""
-    today = datetime.date.today().isoformat()  # ISO format always
+_PENDING_ROWS = []  # rows queued by mark_posted, written by flush_posted
+
+def mark_posted(today, message, post_number, topic, fb_post_id=None):
+    """Queue a log row: [YYYY-MM-DD, Topic, Message, PostNumber, FBPostID]"""
+    _PENDING_ROWS.append([today.isoformat(), topic, message, post_number, fb_post_id or ""])  # ISO format always
+
+def flush_posted():
+    """Write all queued log rows with a single Sheets append call."""
+    if not _PENDING_ROWS:
+        return
     sheet = get_sheet()
-    sheet.append_row([today, topic, message, post_number, fb_post_id or ""])
+    sheet.append_rows(_PENDING_ROWS, value_input_option="RAW")
+    _PENDING_ROWS.clear()
 
-def count_posts_today():
-    """Count how many rows in the sheet have today's ISO date."""
+def load_rows():
+    """Read the log's date + topic columns once per run (header skipped; messages stay server-side)."""
     sheet = get_sheet()
-    today = datetime.date.today().isoformat()
-    rows = sheet.get_all_values()[1:]  # skip header
-    return sum(1 for row in rows if row and len(row) > 0 and row[0] == today)
+    return sheet.get("A2:B")
+
+def count_posts_today(rows, today):
+    """Count how many rows have today's ISO date."""
+    today_iso = today.isoformat()
+    return sum(1 for row in rows if row and len(row) > 0 and row[0] == today_iso)
 
 # ====== TOPICS & STYLES ======
-def get_post_themes():
-    return [
-        "African fashion trends and designers",
-        "African innovations and technology breakthroughs",
-        "Stories of everyday life in different African countries",
-        "Economic developments and trade history",
-        "Modern African leaders and diplomacy",
-        "African cuisine and traditional recipes",
-        "Educational and intellectual movements",
-        "African sports achievements and history",
-        "Cultural preservation during colonial period",
-        "African languages and linguistic diversity",
-        "Travel and tourism destinations in Africa",
-        "Notable African scientists and inventors",
-        "Women’s roles in African history",
-        "Environmental conservation in Africa",
-        "Festivals, rituals, and cultural celebrations",
-        "Health initiatives and medical breakthroughs",
-        "Community projects and social impact initiatives",
-        "Emerging African entrepreneurs and startups",
-        "Post-independence achievements and challenges",
-        "Tech hubs and innovation centers across Africa",
-        "African art, music, and literature",
-        "African wildlife and national parks",
-    ]
-
-def get_post_styles():
-    return [
-        "Share an inspiring story about {topic} that everyone can learn from.",
-        "Highlight the historical significance of {topic}.",
-        "Explain {topic} in a way that educates and engages readers.",
-        "Tell a little-known fact about {topic}.",
-        "Discuss how {topic} shaped African history and culture.",
-        "Celebrate achievements in {topic} and their lasting impact.",
-        "Provide an interesting anecdote about {topic}.",
-        "Showcase the people behind {topic} and their contributions.",
-        "Explain {topic} in a practical context for readers today.",
-    ]
+POST_THEMES = (
+    "African fashion trends and designers",
+    "African innovations and technology breakthroughs",
+    "Stories of everyday life in different African countries",
+    "Economic developments and trade history",
+    "Modern African leaders and diplomacy",
+    "African cuisine and traditional recipes",
+    "Educational and intellectual movements",
+    "African sports achievements and history",
+    "Cultural preservation during colonial period",
+    "African languages and linguistic diversity",
+    "Travel and tourism destinations in Africa",
+    "Notable African scientists and inventors",
+    "Women’s roles in African history",
+    "Environmental conservation in Africa",
+    "Festivals, rituals, and cultural celebrations",
+    "Health initiatives and medical breakthroughs",
+    "Community projects and social impact initiatives",
+    "Emerging African entrepreneurs and startups",
+    "Post-independence achievements and challenges",
+    "Tech hubs and innovation centers across Africa",
+    "African art, music, and literature",
+    "African wildlife and national parks",
+)
+
+POST_STYLES = (
+    "Share an inspiring story about {topic} that everyone can learn from.",
+    "Highlight the historical significance of {topic}.",
+    "Explain {topic} in a way that educates and engages readers.",
+    "Tell a little-known fact about {topic}.",
+    "Discuss how {topic} shaped African history and culture.",
+    "Celebrate achievements in {topic} and their lasting impact.",
+    "Provide an interesting anecdote about {topic}.",
+    "Showcase the people behind {topic} and their contributions.",
+    "Explain {topic} in a practical context for readers today.",
+)
+
+TEXT_PROMPT_TEMPLATE = (
+    "Write a unique, engaging Facebook post (max 120 words) about {topic}. "
+    "{style} "
+    "Do NOT include any disclaimers about future dates or uncertainties. "
+    "Structure the text in clear paragraphs and include 2 relevant hashtags."
+)
+
+IMAGE_PROMPT_TEMPLATE = (
+    "Realistic historical illustration of {topic}, inspired by '{style}', "
+    "high detail, cinematic lighting, photo-realistic, educational style"
+)
+
+# Boilerplate some providers prepend to completions; stripped from generated text
+DISCLAIMER_RE = re.compile(r"(I think there may be a mistake.*?See more)", re.DOTALL)
 
 # ====== TEXT GENERATION (Groq) ======
-def generate_text(topic, post_number=1):
-    styles = get_post_styles()
-    selected_style = random.choice(styles).format(topic=topic)
-
-    prompt = (
-        f"Write a unique, engaging Facebook post (max 120 words) about {topic}. "
-        f"{selected_style} "
-        f"Do NOT include any disclaimers about future dates or uncertainties. "
-        f"Structure the text in clear paragraphs and include 2 relevant hashtags."
-    )
+def pick_style(topic):
+    """Pick the writing style up front so text and image can be requested together."""
+    return random.choice(POST_STYLES).format(topic=topic)
+
+def generate_text(topic, selected_style):
+    prompt = TEXT_PROMPT_TEMPLATE.format(topic=topic, style=selected_style)
 
-    url = "https://api.groq.com/openai/v1/chat/completions"
     headers = {"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"}
-    data = {
-        "model": "llama-3.3-70b-versatile",
-        "messages": [{"role": "user", "content": prompt}],
-        "max_tokens": 300,
-        "temperature": 0.7,
-        "top_p": 0.9,
-    }
+    data = {**GROQ_BASE_PAYLOAD, "messages": [{"role": "user", "content": prompt}]}
 
     try:
-        resp = requests.post(url, headers=headers, json=data, timeout=60)
+        resp = SESSION.post(GROQ_CHAT_URL, headers=headers, json=data, timeout=TEXT_TIMEOUT)
         resp.raise_for_status()
         content = resp.json()["choices"][0]["message"]["content"]
         # strip any unwanted boilerplate if providers inject it
-        content = re.sub(r"(I think there may be a mistake.*?See more)", "", content, flags=re.DOTALL)
-        return content.strip(), topic, selected_style
+        content = DISCLAIMER_RE.sub("", content)
+        return content.strip()
     except Exception as e:
         logging.error(f"Error generating text: {e}")
-        return None, topic, selected_style
+        return None
 
 # ====== IMAGE GENERATION (Hugging Face) ======
 def generate_image_hf(topic, style):
     headers = {"Authorization": f"Bearer {HF_TOKEN}"}
-    prompt = (
-        f"Realistic historical illustration of {topic}, inspired by '{style}', "
-        f"high detail, cinematic lighting, photo-realistic, educational style"
-    )
+    prompt = IMAGE_PROMPT_TEMPLATE.format(topic=topic, style=style)
     payload = {
         "inputs": prompt,
-        "options": {"wait_for_model": True, "width": IMAGE_WIDTH, "height": IMAGE_HEIGHT},
+        "parameters": {"width": IMAGE_WIDTH, "height": IMAGE_HEIGHT},
+        "options": {"wait_for_model": True},
     }
     try:
-        resp = requests.post(
-            f"https://api-inference.huggingface.co/models/{HF_IMAGE_MODEL}",
+        resp = SESSION.post(
+            f"{HF_API_URL}models/{HF_IMAGE_MODEL}",
             headers=headers,
             json=payload,
-            timeout=120,
+            timeout=IMAGE_TIMEOUT,
         )
         resp.raise_for_status()
         return resp.content  # bytes
@@ -160,11 +253,11 @@ def post_to_facebook(message, image_bytes=None):
             fb_url = f"https://graph.facebook.com/{FB_PAGE_ID}/photos"
             files = {"source": ("image.png", image_bytes, "image/png")}
             payload = {"caption": message, "access_token": FB_PAGE_ACCESS_TOKEN}
-            r = requests.post(fb_url, data=payload, files=files, timeout=60)
+            r = SESSION.post(fb_url, data=payload, files=files, timeout=FB_TIMEOUT)
         else:
             fb_url = f"https://graph.facebook.com/{FB_PAGE_ID}/feed"
             payload = {"message": message, "access_token": FB_PAGE_ACCESS_TOKEN}
-            r = requests.post(fb_url, data=payload, timeout=60)
+            r = SESSION.post(fb_url, data=payload, timeout=FB_TIMEOUT)
 
         r.raise_for_status()
         result = r.json()
@@ -178,32 +271,31 @@ def post_to_facebook(message, image_bytes=None):
         return None
 
 # ====== CHECK RECENT TOPICS (avoid repeats) ======
-def already_posted_topic(topic):
-    """Avoid reposting same topic within the last 2 days (robust date parsing, skip header)."""
-    sheet = get_sheet()
-    rows = sheet.get_all_values()[1:]  # skip header
-    today = datetime.date.today()
-    two_days_ago = today - datetime.timedelta(days=2)
+def load_recent_topics(rows, today, days=2):
+    """Return the set of topics posted within the last `days` days."""
+    cutoff = today - datetime.timedelta(days=days)
 
+    recent = set()
     for row in rows:
         if len(row) < 2:
             continue
         try:
-            post_date = parser.parse(row[0]).date()
-        except Exception:
-            continue
-        posted_topic = row[1]
-        if post_date >= two_days_ago and posted_topic == topic:
-            return True
-    return False
-
-def pick_topic_for_today():
-    themes = get_post_themes()
-    random.shuffle(themes)
-    for t in themes:
-        if not already_posted_topic(t):
-            return t
-    return random.choice(themes)  # fallback
+            post_date = datetime.date.fromisoformat(row[0])  # mark_posted always writes ISO
+        except ValueError:
+            from dateutil import parser  # only needed for legacy / hand-edited rows
+
+            try:
+                post_date = parser.parse(row[0]).date()
+            except (ValueError, OverflowError):
+                continue
+        if post_date >= cutoff:
+            recent.add(row[1])
+    return recent
+
+def pick_topic_for_today(rows, today):
+    recent = load_recent_topics(rows, today)
+    available = [t for t in POST_THEMES if t not in recent]
+    return random.choice(available or POST_THEMES)  # fallback: allow repeats
 
 # ====== MAIN (single post per run; GitHub Actions cron controls timing) ======
 if __name__ == "__main__":
@@ -214,20 +306,31 @@ if __name__ == "__main__":
         raise SystemExit(1)
 
     # Make exactly ONE post per run; rely on Actions cron (e.g., 07:00, 13:00, 19:00 UTC)
-    posts_today = count_posts_today()
+    today = datetime.date.today()  # fixed once so every step agrees on the date
+    rows = load_rows()  # single sheet read shared by the limit check and topic picker
+    posts_today = count_posts_today(rows, today)
     if posts_today >= DAILY_POST_LIMIT:
         logging.info(f"✅ Already posted {DAILY_POST_LIMIT} times today. Exiting.")
         raise SystemExit(0)
 
-    post_number = posts_today + 1
-    topic = pick_topic_for_today()
-    text, topic, style = generate_text(topic, post_number)
-
-    if text:
-        image_bytes = generate_image_hf(topic, style)
-        fb_post_id = post_to_facebook(text, image_bytes)
-        if fb_post_id:
-            mark_posted(text, post_number, topic, fb_post_id)
-            logging.info(f"✅ Post #{post_number} completed successfully!")
-    else:
-        logging.error(f"❌ Could not generate text for post #{post_number}.")
+    try:
+        post_number = posts_today + 1
+        topic = pick_topic_for_today(rows, today)
+        style = pick_style(topic)
+
+        # Text and image only depend on (topic, style), so overlap the two slow API calls
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            text_future = pool.submit(generate_text, topic, style)
+            image_future = pool.submit(generate_image_hf, topic, style)
+            text = text_future.result()
+            image_bytes = image_future.result()
+
+        if text:
+            fb_post_id = post_to_facebook(text, image_bytes)
+            if fb_post_id:
+                mark_posted(today, text, post_number, topic, fb_post_id)
+                logging.info(f"✅ Post #{post_number} completed successfully!")
+        else:
+            logging.error(f"❌ Could not generate text for post #{post_number}.")
+    finally:
+        flush_posted()